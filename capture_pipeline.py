@@ -0,0 +1,75 @@
+# capture_pipeline.py - Kindleの撮影とOCRを並行して行う
+#
+# 撮影スレッドがページをめくりながらスクリーンショットを保存してキューに入れ、
+# OCR側は届いたページから順にOCRを開始する。
+# 全ページ撮影してからOCRするよりも、合計時間が「撮影」と「OCR」の長い方に近づく。
+#
+# 例：
+#   from capture_pipeline import capture_and_ocr_to_markdown
+#   capture_and_ocr_to_markdown("screenshots", 100, (0, 0, 1920, 1080), "output.md")
+
+import os
+import queue
+import threading
+
+from config_manager import config
+from kindle_controller import KindleController
+from ocr_images_to_md import ocr_queue_to_markdown
+from screenshot_manager import ScreenshotManager
+
+
+def capture_and_ocr_to_markdown(save_folder, pages, capture_rect, output_md_path, lang=None,
+                                page_key=None, wait=0.5, progress_callback=None) -> bool:
+    """Kindleのページを撮影しながらOCRしてMarkdownに保存し、成功可否を返す
+
+    Args:
+        save_folder: スクリーンショットの保存先フォルダ
+        pages: 撮影するページ数
+        capture_rect: キャプチャ領域 (left, top, width, height)
+        output_md_path: 出力するMarkdownファイルのパス
+        lang: OCR言語（指定しない場合は app.default_ocr_lang）
+        page_key: ページ送りのキー（指定しない場合は app.default_page_key）
+        wait: ページ送り後、次の撮影までの待ち時間（秒）
+        progress_callback: OCRの進捗 (page, total) を受け取る関数
+    """
+    lang = lang or config.get("app.default_ocr_lang", "jpn+eng")
+    page_key = page_key or config.get("app.default_page_key", "right")
+    filename_format = config.get("capture.filename_format", "screenshot_{:04d}.png")
+
+    if not KindleController.activate_kindle(config.get("app.window_keyword", "Kindle for PC")):
+        return False
+    ScreenshotManager.create_folder(save_folder)
+
+    page_queue = queue.Queue()
+    errors = []
+    # OCR側が例外で終了した場合に、撮影スレッドのページ送りを止める
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for idx in range(pages):
+                if stop.is_set():
+                    break
+                save_path = os.path.join(save_folder, filename_format.format(idx + 1))
+                ScreenshotManager.take_screenshot(save_path, capture_rect)
+                page_queue.put((idx, save_path))
+                if idx < pages - 1:
+                    KindleController.send_page_turn(page_key)
+                    stop.wait(wait)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            # 撮影が途中で失敗しても、OCR側が終了できるように終端を送る
+            page_queue.put(None)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        ocr_queue_to_markdown(page_queue, output_md_path, lang, progress_callback, total=pages)
+    finally:
+        stop.set()
+        producer.join()
+
+    if errors:
+        raise errors[0]
+    return True
@@ -14,13 +14,38 @@
 #   config.set_capture_region(x, y, w, h)
 #   folder = config.get_save_folder()
 #   config.set_save_folder(path)
+#
+# set_capture_region()などの保存用メソッドは呼び出しごとにconfig.local.jsonへ保存する。
+# set_local()で複数の値を変更する場合は、最後にconfig.flush()を呼んでまとめて保存すること
+# （終了時のatexitは強制終了では実行されないので、それだけに頼らない）。
 
 
+import atexit
 import json
 import os
+from collections import OrderedDict
 from typing import Dict, Any, Optional
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_loads(data: bytes) -> Any:
+    """JSONを読み込み（orjsonがあれば使用）"""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(obj: Any) -> bytes:
+    """JSONをUTF-8のバイト列に書き出し（orjsonがあれば使用）"""
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
+
 
 class ConfigManager:
     """設定管理クラス - GitHub共有用とローカル専用の設定を分離管理"""
@@ -39,6 +64,13 @@ class ConfigManager:
         # ローカル専用設定ファイル（.gitignoreに追加）
         self.local_config_file = self.base_dir / "config.local.json"
         
+        # get()のキャッシュ用: ドット区切りパスの分割結果と取得結果
+        self._path_cache: Dict[str, tuple] = {}
+        self._get_cache: Dict[str, Any] = {}
+        
+        # _set_nested_value()用: (設定のid, 親キーのタプル) → 親の辞書
+        self._parent_cache: Dict[tuple, dict] = {}
+        
         # デフォルト設定
         self.default_shared_config = {
             "app": {
@@ -61,7 +93,9 @@ class ConfigManager:
             "ocr": {
                 "tesseract_config": "--psm 6",
                 "supported_languages": ["jpn", "jpn_vert", "eng", "jpn+jpn_vert+eng"],
-                "output_format": "markdown"
+                "output_format": "markdown",
+                "preprocess_grayscale": True,
+                "preprocess_max_width": 2400
             }
         }
         
@@ -81,55 +115,96 @@ class ConfigManager:
         # 設定を読み込み
         self.shared_config = self.load_shared_config()
         self.local_config = self.load_local_config()
+        
+        # ローカル設定の未保存変更フラグ（set_localは書き込まず、flush時にまとめて保存）
+        self._local_dirty = False
+        atexit.register(self.flush)
+        
+        # create_gitignore()を実行済みか（同じプロセス内で再度.gitignoreを読まない）
+        self._gitignore_done = False
+    
+    @property
+    def shared_config(self) -> Dict[str, Any]:
+        """GitHub共有用設定"""
+        return self._shared_config
+    
+    @shared_config.setter
+    def shared_config(self, value: Dict[str, Any]) -> None:
+        # 設定を差し替えた場合はキャッシュを無効化
+        self._shared_config = value
+        self._get_cache.clear()
+        self._parent_cache.clear()
+    
+    @property
+    def local_config(self) -> Dict[str, Any]:
+        """ローカル専用設定"""
+        return self._local_config
+    
+    @local_config.setter
+    def local_config(self, value: Dict[str, Any]) -> None:
+        # 設定を差し替えた場合はキャッシュを無効化
+        self._local_config = value
+        self._get_cache.clear()
+        self._parent_cache.clear()
     
     def load_shared_config(self) -> Dict[str, Any]:
         """GitHub共有用設定を読み込み"""
-        if self.shared_config_file.exists():
-            try:
-                with open(self.shared_config_file, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                # デフォルト設定とマージ
-                return self._merge_configs(self.default_shared_config, config)
-            except (json.JSONDecodeError, FileNotFoundError) as e:
-                print(f"共有設定ファイル読み込みエラー: {e}")
-                return self.default_shared_config.copy()
-        else:
+        try:
+            config = self._read_config_file(self.shared_config_file)
+        except FileNotFoundError:
             return self.default_shared_config.copy()
+        except json.JSONDecodeError as e:
+            print(f"共有設定ファイル読み込みエラー: {e}")
+            return self.default_shared_config.copy()
+        # デフォルト設定とマージ
+        return self._merge_configs(self.default_shared_config, config)
     
     def load_local_config(self) -> Dict[str, Any]:
         """ローカル専用設定を読み込み"""
-        if self.local_config_file.exists():
-            try:
-                with open(self.local_config_file, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                # デフォルト設定とマージ
-                return self._merge_configs(self.default_local_config, config)
-            except (json.JSONDecodeError, FileNotFoundError) as e:
-                print(f"ローカル設定ファイル読み込みエラー: {e}")
-                return self.default_local_config.copy()
-        else:
+        try:
+            config = self._read_config_file(self.local_config_file)
+        except FileNotFoundError:
             return self.default_local_config.copy()
+        except json.JSONDecodeError as e:
+            print(f"ローカル設定ファイル読み込みエラー: {e}")
+            return self.default_local_config.copy()
+        # デフォルト設定とマージ
+        return self._merge_configs(self.default_local_config, config)
+    
+    def _read_config_file(self, path: Path) -> Dict[str, Any]:
+        """設定ファイルを読み込み（ファイルが無ければ FileNotFoundError）"""
+        with open(path, 'rb') as f:
+            return _json_loads(f.read())
     
     def save_shared_config(self) -> bool:
         """GitHub共有用設定を保存"""
         try:
-            with open(self.shared_config_file, 'w', encoding='utf-8') as f:
-                json.dump(self.shared_config, f, indent=2, ensure_ascii=False)
+            with open(self.shared_config_file, 'wb') as f:
+                f.write(_json_dumps(self.shared_config))
             return True
         except Exception as e:
             print(f"共有設定ファイル保存エラー: {e}")
             return False
     
     def save_local_config(self) -> bool:
-        """ローカル専用設定を保存"""
+        """ローカル専用設定を保存（一時ファイルに書いてから置き換える）"""
+        tmp_file = self.local_config_file.with_suffix('.json.tmp')
         try:
-            with open(self.local_config_file, 'w', encoding='utf-8') as f:
-                json.dump(self.local_config, f, indent=2, ensure_ascii=False)
+            with open(tmp_file, 'wb') as f:
+                f.write(_json_dumps(self.local_config))
+            os.replace(tmp_file, self.local_config_file)
+            self._local_dirty = False
             return True
         except Exception as e:
             print(f"ローカル設定ファイル保存エラー: {e}")
             return False
     
+    def flush(self) -> bool:
+        """未保存のローカル設定があれば保存"""
+        if not self._local_dirty:
+            return True
+        return self.save_local_config()
+    
     def get(self, key_path: str, default: Any = None) -> Any:
         """設定値を取得（ドット記法対応）
         
@@ -140,16 +215,16 @@ class ConfigManager:
         Returns:
             設定値
         """
-        # まずローカル設定から検索
-        value = self._get_nested_value(self.local_config, key_path)
-        if value is not None:
-            return value
-        
-        # 次に共有設定から検索
-        value = self._get_nested_value(self.shared_config, key_path)
+        try:
+            value = self._get_cache[key_path]
+        except KeyError:
+            # まずローカル設定から検索し、無ければ共有設定から検索
+            value = self._get_nested_value(self.local_config, key_path)
+            if value is None:
+                value = self._get_nested_value(self.shared_config, key_path)
+            self._get_cache[key_path] = value
         if value is not None:
             return value
-        
         return default
     
     def set_shared(self, key_path: str, value: Any) -> None:
@@ -157,14 +232,15 @@ class ConfigManager:
         self._set_nested_value(self.shared_config, key_path, value)
     
     def set_local(self, key_path: str, value: Any) -> None:
-        """ローカル設定を設定"""
+        """ローカル設定を設定（保存はされないので、変更後にflush()を呼ぶこと）"""
         self._set_nested_value(self.local_config, key_path, value)
+        self._local_dirty = True
     
     def update_capture_region(self, x: int, y: int, width: int, height: int) -> None:
         """キャプチャ領域を更新"""
         region = {"x": x, "y": y, "width": width, "height": height}
         self.set_local("user_preferences.last_used_region", region)
-        self.save_local_config()
+        self.flush()
     
     def get_capture_region(self) -> dict:
         """キャプチャ領域を取得（ローカル→共有→デフォルト）"""
@@ -183,7 +259,7 @@ class ConfigManager:
         """キャプチャ領域をローカル設定に保存"""
         region = {"x": x, "y": y, "width": width, "height": height}
         self.set_local("user_preferences.last_used_region", region)
-        self.save_local_config()
+        self.flush()
     
     def get_save_folder(self) -> str:
         """保存先フォルダを取得（ローカル→共有→デフォルト）"""
@@ -198,23 +274,24 @@ class ConfigManager:
     def set_save_folder(self, folder_path: str) -> None:
         """保存先フォルダをローカル設定に保存"""
         self.set_local("user_preferences.last_save_folder", folder_path)
-        self.save_local_config()
+        self.flush()
     
     def add_recent_project(self, project_info: Dict[str, Any]) -> None:
         """最近のプロジェクトを追加"""
         recent = self.get("user_preferences.recent_projects", [])
+        title = project_info.get("title")
         
-        # 重複を除去
-        recent = [p for p in recent if p.get("title") != project_info.get("title")]
-        
-        # 先頭に追加
-        recent.insert(0, project_info)
+        # タイトルをキーにして重複を除去し、先頭に追加
+        projects = OrderedDict((p.get("title"), p) for p in recent)
+        projects.pop(title, None)
+        projects[title] = project_info
+        projects.move_to_end(title, last=False)
         
         # 最大10件まで保持
-        recent = recent[:10]
+        recent = list(projects.values())[:10]
         
         self.set_local("user_preferences.recent_projects", recent)
-        self.save_local_config()
+        self.flush()
     
     def get_recent_projects(self) -> list:
         """最近のプロジェクト一覧を取得"""
@@ -222,6 +299,9 @@ class ConfigManager:
     
     def create_gitignore(self) -> None:
         """設定に関する.gitignoreエントリを作成/追加"""
+        if self._gitignore_done:
+            return
+        
         gitignore_path = self.base_dir / ".gitignore"
         
         entries_to_add = [
@@ -236,14 +316,16 @@ class ConfigManager:
             "# スクリーンショット",
             "screenshot_*.png",
             "screenshots/",
+            "ocr_cache/",
             ""
         ]
         
         # 既存の.gitignoreを読み込み
-        existing_entries = []
+        existing_lines = []
         if gitignore_path.exists():
             with open(gitignore_path, 'r', encoding='utf-8') as f:
-                existing_entries = f.read().splitlines()
+                existing_lines = f.read().splitlines()
+        existing_entries = set(existing_lines)
         
         # 追加する必要があるエントリをフィルタ
         entries_to_write = []
@@ -254,24 +336,28 @@ class ConfigManager:
         # 新しいエントリがある場合のみ追記
         if entries_to_write:
             with open(gitignore_path, 'a', encoding='utf-8') as f:
-                if existing_entries and existing_entries[-1] != "":
+                if existing_lines and existing_lines[-1] != "":
                     f.write("\n")
                 f.write("\n".join(entries_to_write))
                 f.write("\n")
+        
+        self._gitignore_done = True
     
     def _merge_configs(self, default: Dict, user: Dict) -> Dict:
         """設定をマージ"""
         result = default.copy()
         for key, value in user.items():
-            if key in result and isinstance(result[key], dict) and isinstance(value, dict):
-                result[key] = self._merge_configs(result[key], value)
+            # 両方がdictの場合のみ再帰（デフォルトに無いキーは再帰せずそのまま採用）
+            current = result.get(key)
+            if type(current) is dict and type(value) is dict:
+                result[key] = self._merge_configs(current, value)
             else:
                 result[key] = value
         return result
     
     def _get_nested_value(self, config: Dict, key_path: str) -> Any:
         """ネストした設定値を取得"""
-        keys = key_path.split('.')
+        keys = self._split_key_path(key_path)
         current = config
         
         try:
@@ -283,17 +369,40 @@ class ConfigManager:
     
     def _set_nested_value(self, config: Dict, key_path: str, value: Any) -> None:
         """ネストした設定値を設定"""
-        keys = key_path.split('.')
-        current = config
+        keys = self._split_key_path(key_path)
+        cache_key = (id(config), keys[:-1])
+        current = self._parent_cache.get(cache_key)
         
-        # 最後のキー以外は辞書を作成
-        for key in keys[:-1]:
-            if key not in current:
-                current[key] = {}
-            current = current[key]
+        if current is None:
+            current = config
+            # 最後のキー以外は辞書を作成
+            for key in keys[:-1]:
+                if key not in current:
+                    current[key] = {}
+                current = current[key]
+            self._parent_cache[cache_key] = current
+        
+        # 辞書（葉でないノード）を置き換える場合は、その配下の親キャッシュを無効化
+        if type(current.get(keys[-1])) is dict:
+            depth = len(keys)
+            config_id = id(config)
+            for cached_id, parent_keys in list(self._parent_cache):
+                if cached_id == config_id and parent_keys[:depth] == keys:
+                    del self._parent_cache[(cached_id, parent_keys)]
         
         # 最後のキーに値を設定
         current[keys[-1]] = value
+        
+        # get()のキャッシュを無効化
+        self._get_cache.clear()
+    
+    def _split_key_path(self, key_path: str) -> tuple:
+        """ドット区切りのパスを分割（結果はキャッシュ）"""
+        keys = self._path_cache.get(key_path)
+        if keys is None:
+            keys = tuple(key_path.split('.'))
+            self._path_cache[key_path] = keys
+        return keys
 
 
 # グローバルインスタンス
@@ -10,20 +10,21 @@ class KindleController:
     @staticmethod
     def activate_kindle(window_title="Kindle for PC") -> bool:
         """Kindle for PC のウィンドウを前面化し、成功可否を返す"""
-        if not gw:
-            print("pygetwindow not installed; cannot activate Kindle window.")
-            return False
-        # 完全一致で探す
-        windows = gw.getWindowsWithTitle(window_title)
-        if windows:
-            hwnd = windows[0]._hWnd
+        # 完全一致で探す（FindWindowWならウィンドウを列挙せず1回の呼び出しで済む）
+        hwnd = ctypes.windll.user32.FindWindowW(None, window_title)
+        if hwnd:
             # ウィンドウを復元＆前面化
             SW_RESTORE = 9
             ctypes.windll.user32.ShowWindow(hwnd, SW_RESTORE)
             ctypes.windll.user32.SetForegroundWindow(hwnd)
             return True
-        # 部分一致で再検索
-        candidates = [w for w in gw.getAllWindows() if window_title.lower() in w.title.lower()]
+        if not gw:
+            print("pygetwindow not installed; cannot activate Kindle window.")
+            return False
+        # 部分一致で再検索（ウィンドウ列挙は1回だけ行い、デバッグ表示にも使い回す）
+        all_windows = gw.getAllWindows()
+        keyword = window_title.lower()
+        candidates = [w for w in all_windows if keyword in w.title.lower()]
         if candidates:
             hwnd = candidates[0]._hWnd
             SW_RESTORE = 9
@@ -31,7 +32,7 @@ class KindleController:
             ctypes.windll.user32.SetForegroundWindow(hwnd)
             return True
         # デバッグ用タイトル表示
-        titles = [w.title for w in gw.getAllWindows()]
+        titles = [w.title for w in all_windows]
         print(f"No window matching '{window_title}'. Available titles:\n{titles}")
         return False
 
@@ -1,71 +1,347 @@
+import math
 import os
+import queue
+import re
 import sys
+import time
+import subprocess
+import tempfile
+import threading
 import pytesseract
 import json
+from PIL import Image
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from config_manager import config
 
-# Windows用Tesseractのパス（必要に応じて変更）
-pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+# OCRキャッシュのキーに使うハッシュ（blake3があれば高速なそちらを使用）
+try:
+    from blake3 import blake3 as _hash_bytes
+except ImportError:
+    from hashlib import sha1 as _hash_bytes
 
-# 画像リストからOCR→Markdown
+# Tesseractのパス（config の paths.tesseract_cmd を優先し、未設定ならWindowsの既定パス）
+pytesseract.pytesseract.tesseract_cmd = (
+    config.get('paths.tesseract_cmd') or r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+)
 
-def ocr_images_to_markdown(image_paths, output_md_path, lang='jpn+eng', progress_callback=None):
-    md_lines = []
+# tesseractに渡す追加オプション（前処理の設定と同様に、呼び出しごとに config から読む）
+
+def _tesseract_config():
+    return config.get('ocr.tesseract_config', '--psm 6')
+
+# 進捗ファイルの更新間隔（秒）
+STATUS_INTERVAL = 0.25
+
+# 撮影キューを待つ間に、OCR済みのページを書き出す間隔（秒）
+QUEUE_POLL_INTERVAL = 0.1
+
+# OCR対象とする画像の拡張子
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+# 1回のtesseract起動でまとめて処理するページ数
+# 言語モデル（jpn+jpn_vert+eng で約100MB）の読み込みをこの枚数ごとに1回で済ませる
+BATCH_SIZE = 16
+
+# 各コアが処理するバッチ数の目安（バッチを小さくして進捗をこまめに報告する）
+BATCH_ROUNDS = 4
+
+# tesseractの子プロセスの環境変数（並列で起動する数に応じてOpenMPのスレッド数を制限する）
+
+def _tesseract_env(threads=1):
+    return {**os.environ, 'OMP_THREAD_LIMIT': str(threads)}
+
+# OCR前の前処理（グレースケール化・縮小）でtesseractの処理量を減らす
+# 幅が ocr.preprocess_max_width を超える画像はその幅まで縮小する
+
+def _needs_downscale(img):
+    max_width = config.get('ocr.preprocess_max_width', 2400)
+    return bool(max_width) and img.width > max_width
+
+def _prepare_image(img):
+    if config.get('ocr.preprocess_grayscale', True) and img.mode != 'L':
+        img = img.convert('L')
+    if _needs_downscale(img):
+        max_width = config.get('ocr.preprocess_max_width', 2400)
+        height = max(1, round(img.height * max_width / img.width))
+        img = img.resize((max_width, height), Image.BILINEAR)
+    return img
+
+# 画像リストを1回のtesseract起動でOCRし、入力順のテキストのリストを返す
+
+def _batch_ocr(paths, lang, cfg, threads=1):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # 縮小が必要な画像だけ前処理して一時フォルダに書き出す
+        # （グレースケール化だけならtesseractが内部で行うので、元画像をそのまま渡す）
+        prepared_paths = []
+        for i, img_path in enumerate(paths):
+            with Image.open(img_path) as img:
+                # Image.openはヘッダだけ読むので、縮小不要な画像はデコードしない
+                if not _needs_downscale(img):
+                    prepared_paths.append(os.path.abspath(img_path))
+                    continue
+                prepared_path = os.path.join(tmpdir, f'page_{i:04d}.png')
+                _prepare_image(img).save(prepared_path, compress_level=1)
+                prepared_paths.append(prepared_path)
+        list_path = os.path.join(tmpdir, 'imagelist.txt')
+        with open(list_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(prepared_paths))
+            f.write('\n')
+        stem = os.path.join(tmpdir, 'out')
+        try:
+            proc = subprocess.run(
+                [pytesseract.pytesseract.tesseract_cmd, list_path, stem, '-l', lang, *cfg.split()],
+                capture_output=True, env=_tesseract_env(threads),
+            )
+        except FileNotFoundError:
+            raise pytesseract.TesseractNotFoundError()
+        if proc.returncode:
+            raise pytesseract.TesseractError(proc.returncode, proc.stderr.decode('utf-8', 'replace').strip())
+        with open(stem + '.txt', 'r', encoding='utf-8') as f:
+            output = f.read()
+    # tesseractはページごとに改ページ文字(\x0c)を出力する
+    texts = output.split('\x0c')[:len(paths)]
+    texts += [''] * (len(paths) - len(texts))
+    return texts
+
+# OCR結果キャッシュのパス（画像フォルダ内の ocr_cache/<画像のハッシュ>-<言語>-<オプション>-<前処理>.txt）
+# 前処理の設定が変わった場合に古い結果を返さないよう、前処理の設定もキーに含める
+
+def _ocr_cache_path(img_path, lang, cfg):
+    with open(img_path, 'rb') as f:
+        digest = _hash_bytes(f.read()).hexdigest()
+    cfg_tag = re.sub(r'[^0-9A-Za-z]', '', cfg)
+    gray = 'g' if config.get('ocr.preprocess_grayscale', True) else 'c'
+    max_width = config.get('ocr.preprocess_max_width', 2400) or 0
+    cache_dir = Path(img_path).parent / 'ocr_cache'
+    return cache_dir / f'{digest}-{lang}-{cfg_tag}-{gray}{max_width}.txt'
+
+# キャッシュは一時ファイルに書いてから置き換える（途中で強制終了されても書きかけの結果を残さない）
+# 同じ内容の画像を複数のスレッドが同時に書くことがあるので、一時ファイル名はスレッドごとに分ける
+
+def _save_ocr_cache(cache_path, text):
+    cache_path.parent.mkdir(exist_ok=True)
+    tmp_path = cache_path.with_name(f'{cache_path.name}.{os.getpid()}-{threading.get_ident()}.tmp')
+    try:
+        tmp_path.write_text(text, encoding='utf-8')
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        # キャッシュの保存に失敗してもOCR結果はそのまま使う
+        print(f"OCRキャッシュ保存エラー: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+# 1ページ分のOCR（キャッシュがあればそれを返す。画像が無い場合は None）
+
+def _ocr_single(img_path, lang, cfg):
+    if not os.path.isfile(img_path):
+        return None
+    cache_path = _ocr_cache_path(img_path, lang, cfg)
+    if cache_path.exists():
+        return cache_path.read_text(encoding='utf-8')
+    text = _batch_ocr([img_path], lang, cfg)[0]
+    _save_ocr_cache(cache_path, text)
+    return text
+
+# 全ページをバッチ単位で並列にOCRし、ページ順に (idx, text) を返す（画像が無い場合 text は None）
+# キャッシュ済みのページはOCRせずキャッシュから返す
+# 実際のOCRはtesseractの子プロセスで行われるため、バッチの並列化はスレッドで十分
+# バッチの大きさは未キャッシュのページ数から決め、各コアが BATCH_ROUNDS 回ほどバッチを処理するようにする
+# バッチ数がコア数より少ない場合は、余ったコアを各tesseractのOpenMPスレッドに割り当てる
+# on_progress には (処理済みページ数, 全ページ数) をバッチが終わるたびに渡す（書き出し順とは独立）
+
+def _ocr_pages(image_paths, lang, cfg=None, on_progress=None):
+    if cfg is None:
+        cfg = _tesseract_config()
     total = len(image_paths)
+    cached = {}
+    misses = []
     for idx, img_path in enumerate(image_paths):
         if not os.path.isfile(img_path):
-            md_lines.append(f"## Page {idx+1}\n画像ファイルが見つかりません: {img_path}\n---\n")
-            if progress_callback:
-                progress_callback(idx+1, total)
             continue
-        from PIL import Image
-        img = Image.open(img_path)
-        text = pytesseract.image_to_string(img, lang=lang)
-        md_lines.append(f"## Page {idx+1}\n")
-        md_lines.append(text)
-        md_lines.append("\n---\n")
-        if progress_callback:
-            progress_callback(idx+1, total)
-    with open(output_md_path, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(md_lines))
+        cache_path = _ocr_cache_path(img_path, lang, cfg)
+        if cache_path.exists():
+            cached[idx] = cache_path.read_text(encoding='utf-8')
+        else:
+            misses.append((idx, img_path, cache_path))
+    done = total - len(misses)
+    if on_progress and done:
+        on_progress(done, total)
+    workers = os.cpu_count() or 1
+    size = max(1, min(BATCH_SIZE, math.ceil(len(misses) / (workers * BATCH_ROUNDS))))
+    batches = [misses[i:i + size] for i in range(0, len(misses), size)]
+    threads = max(1, workers // max(1, len(batches)))
+    miss_idx = {idx for idx, _, _ in misses}
+    texts = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {
+            executor.submit(_batch_ocr, [p for _, p, _ in batch], lang, cfg, threads): batch
+            for batch in batches
+        }
+        for idx in range(total):
+            # このページを含むバッチが終わるまで、終わったバッチから順に結果を受け取る
+            while idx in miss_idx and idx not in texts:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    batch = pending.pop(future)
+                    for (i, _, cache_path), text in zip(batch, future.result()):
+                        _save_ocr_cache(cache_path, text)
+                        texts[i] = text
+                    done += len(batch)
+                if on_progress:
+                    on_progress(done, total)
+            if idx in cached:
+                yield idx, cached[idx]
+            else:
+                # 見つからなかった画像の分は None（プレースホルダ）
+                yield idx, texts.pop(idx, None)
+
+# フォルダ内の画像ファイルのパスを名前順で返す
+
+def _list_images(folder_path):
+    with os.scandir(folder_path) as it:
+        return sorted(e.path for e in it if e.is_file() and e.name.lower().endswith(IMAGE_EXTS))
+
+# 1ページ分のMarkdownを書き出す
+
+def _write_page(out, page, img_path, text):
+    if text is None:
+        out.write(f"## Page {page}\n画像ファイルが見つかりません: {img_path}\n---\n\n")
+        return
+    out.write(f"## Page {page}\n\n")
+    out.write(text)
+    out.write("\n\n---\n\n")
+
+# 画像リストからOCR→Markdown
+
+def ocr_images_to_markdown(image_paths, output_md_path, lang='jpn+eng', progress_callback=None):
+    total = len(image_paths)
+    # ページごとに逐次書き出し、全ページ分のテキストをメモリに溜めない
+    out = open(output_md_path, 'w', encoding='utf-8', buffering=1 << 20)
+    try:
+        for idx, text in _ocr_pages(image_paths, lang, on_progress=progress_callback):
+            _write_page(out, idx+1, image_paths[idx], text)
+    finally:
+        out.close()
+
+# キューから届いた画像を順次OCR→Markdown（撮影とOCRを並行させる場合）
+# page_queue には (idx, img_path) を入れ、最後に None を入れて終了を知らせる
+# OCRは届いた順に開始し、書き出しはページ順に行う
+
+def ocr_queue_to_markdown(page_queue, output_md_path, lang='jpn+eng', progress_callback=None, total=None):
+    futures = {}
+    paths = {}
+    next_idx = 0
+    cfg = _tesseract_config()
+    out = open(output_md_path, 'w', encoding='utf-8', buffering=1 << 20)
+
+    def drain(block):
+        nonlocal next_idx
+        while next_idx in futures and (block or futures[next_idx].done()):
+            text = futures.pop(next_idx).result()
+            _write_page(out, next_idx+1, paths.pop(next_idx), text)
+            if progress_callback:
+                progress_callback(next_idx+1, total)
+            next_idx += 1
+
+    try:
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            while True:
+                # 次のページを待つ間も、OCRが終わったページは書き出す
+                try:
+                    item = page_queue.get(timeout=QUEUE_POLL_INTERVAL)
+                except queue.Empty:
+                    drain(block=False)
+                    continue
+                if item is None:
+                    break
+                idx, img_path = item
+                paths[idx] = img_path
+                futures[idx] = executor.submit(_ocr_single, img_path, lang, cfg)
+                drain(block=False)
+            drain(block=True)
+    finally:
+        out.close()
+
+# PIL.Imageのリストから直接OCR→Markdown（スクリーンショットをファイルに保存しない場合）
+
+def ocr_images_objects_to_markdown(images, output_md_path, lang='jpn+eng', progress_callback=None):
+    total = len(images)
+    workers = os.cpu_count() or 1
+    cfg = _tesseract_config()
+    # pytesseractは子プロセスに環境変数をそのまま渡すので、ここでOpenMPのスレッド数を制限する
+    # （ページを並列にOCRするので、コアをページ数で分ける）
+    os.environ['OMP_THREAD_LIMIT'] = str(max(1, workers // max(1, total)))
+    out = open(output_md_path, 'w', encoding='utf-8', buffering=1 << 20)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            texts = executor.map(lambda img: pytesseract.image_to_string(_prepare_image(img), lang=lang, config=cfg), images)
+            for idx, text in enumerate(texts):
+                _write_page(out, idx+1, None, text)
+                if progress_callback:
+                    progress_callback(idx+1, total)
+    finally:
+        out.close()
 
 # フォルダ内画像をOCR→Markdown
 
 def ocr_images_in_folder_to_markdown(folder_path, output_md_path, lang='jpn+eng', progress_callback=None):
-    exts = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
-    files = [f for f in os.listdir(folder_path) if f.lower().endswith(exts)]
-    files.sort()
-    image_paths = [os.path.join(folder_path, f) for f in files]
+    image_paths = _list_images(folder_path)
     ocr_images_to_markdown(image_paths, output_md_path, lang, progress_callback)
 
+# 進捗ファイルを書き出す（一時ファイルに書いてから置き換え、監視側が書きかけを読まないようにする）
+# Windowsでは監視側が進捗ファイルを開いている間は置き換えに失敗するので、少し待って再試行する
+# それでも失敗した場合は今回の更新を諦める（進捗の書き出し失敗でOCRを止めない）
+
+def _write_status(status_path, status, retries=3):
+    tmp_path = status_path + '.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(status, f)
+        for attempt in range(retries):
+            try:
+                os.replace(tmp_path, status_path)
+                return
+            except OSError:
+                if attempt == retries - 1:
+                    raise
+                time.sleep(0.05)
+    except OSError as e:
+        print(f"進捗ファイル書き込みエラー: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
 # サブプロセス用: 進捗ファイルで監視
 
 def ocr_images_in_folder_to_markdown_with_status(folder_path, output_md_path, lang='jpn+eng', status_path=None):
-    exts = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
-    files = [f for f in os.listdir(folder_path) if f.lower().endswith(exts)]
-    files.sort()
-    image_paths = [os.path.join(folder_path, f) for f in files]
-    md_lines = []
+    image_paths = _list_images(folder_path)
     total = len(image_paths)
-    for idx, img_path in enumerate(image_paths):
-        page = idx + 1
-        status = {"page": page, "total": total, "status": "running"}
-        if status_path:
-            with open(status_path, 'w', encoding='utf-8') as f:
-                json.dump(status, f)
-        if not os.path.isfile(img_path):
-            md_lines.append(f"## Page {page}\n画像ファイルが見つかりません: {img_path}\n---\n")
-            continue
-        from PIL import Image
-        img = Image.open(img_path)
-        text = pytesseract.image_to_string(img, lang=lang)
-        md_lines.append(f"## Page {page}\n")
-        md_lines.append(text)
-        md_lines.append("\n---\n")
-    with open(output_md_path, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(md_lines))
+    out = open(output_md_path, 'w', encoding='utf-8', buffering=1 << 20)
+    if status_path:
+        # OCRを始める前に開始を知らせる（最初のバッチが終わるまで進捗ファイルが無い状態にしない）
+        _write_status(status_path, {"page": 0, "total": total, "status": "running"})
+    last_emit = time.monotonic()
+
+    def on_progress(page, total):
+        nonlocal last_emit
+        # 進捗は最終ページか前回から STATUS_INTERVAL 秒以上経った時だけ書き出す
+        now = time.monotonic()
+        if status_path and (page == total or now - last_emit > STATUS_INTERVAL):
+            _write_status(status_path, {"page": page, "total": total, "status": "running"})
+            last_emit = now
+
+    try:
+        for idx, text in _ocr_pages(image_paths, lang, on_progress=on_progress):
+            _write_page(out, idx+1, image_paths[idx], text)
+    finally:
+        out.close()
     if status_path:
-        with open(status_path, 'w', encoding='utf-8') as f:
-            json.dump({"page": total, "total": total, "status": "done"}, f)
+        # 完了の通知は監視側が終了を判定するのに必要なので、長めに再試行する
+        _write_status(status_path, {"page": total, "total": total, "status": "done"}, retries=20)
 
 if __name__ == '__main__':
     if len(sys.argv) >= 4 and sys.argv[1] == '--folder':
@@ -1,5 +1,22 @@
 import os
+import threading
 import pyautogui
+from PIL import Image
+
+try:
+    import mss
+    import mss.tools
+except ImportError:
+    mss = None
+
+# mssのインスタンスはデバイスコンテキストを保持するため、スレッドごとに1つ作って使い回す
+_local = threading.local()
+
+def _get_sct():
+    sct = getattr(_local, 'sct', None)
+    if sct is None:
+        sct = _local.sct = mss.mss()
+    return sct
 
 class ScreenshotManager:
     @staticmethod
@@ -9,8 +26,25 @@ class ScreenshotManager:
     @staticmethod
     def take_screenshot(save_path, capture_rect):
         # capture_rect: (left, top, width, height)
-        screenshot = pyautogui.screenshot(region=capture_rect)
-        screenshot.save(save_path)
+        if not mss:
+            screenshot = pyautogui.screenshot(region=capture_rect)
+            screenshot.save(save_path)
+            return
+        left, top, width, height = capture_rect
+        img = _get_sct().grab({'left': left, 'top': top, 'width': width, 'height': height})
+        if save_path.lower().endswith('.png'):
+            mss.tools.to_png(img.rgb, img.size, output=save_path)
+        else:
+            Image.frombytes('RGB', img.size, img.rgb).save(save_path)
+
+    @staticmethod
+    def grab_image(capture_rect):
+        """指定領域をキャプチャし、ファイルに保存せずPIL.Imageで返す"""
+        if not mss:
+            return pyautogui.screenshot(region=capture_rect)
+        left, top, width, height = capture_rect
+        img = _get_sct().grab({'left': left, 'top': top, 'width': width, 'height': height})
+        return Image.frombytes('RGB', img.size, img.rgb)
 
     @staticmethod
     def delete_files(file_paths):